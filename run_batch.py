@@ -0,0 +1,343 @@
+import os
+import io
+import re
+import base64
+import csv
+import time
+from PIL import Image
+from openai import OpenAI
+
+try:
+    # orjson.dumps returns bytes directly, which suits the binary JSONL
+    # writer below; loads is 3-10x faster on the batch output too.
+    import orjson as json
+except ImportError:
+    import json
+
+
+def _dumps_line(obj) -> bytes:
+    """One JSONL line as bytes, whichever json module is in play."""
+    data = json.dumps(obj)
+    return data if isinstance(data, bytes) else data.encode("utf-8")
+
+# === 1. Configuration ===
+# Ensure your environment variable OPENAI_API_KEY is set.
+# The client is constructed in main() so importing this module has no
+# side effects (no directories created, no HTTP machinery spawned).
+client = None
+
+def _build_client():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("⚠️ WARNING: OPENAI_API_KEY not found. Please set it before running.")
+    return OpenAI(api_key=api_key)
+
+# Using GPT-4o for best Multimodal (Vision) performance
+MODEL_NAME = "gpt-4o"
+
+# Input/Output Directories
+IMAGE_DIR = "images_from_docx"
+RESULTS_DIR = "results"
+BATCH_INPUT_JSONL = os.path.join(RESULTS_DIR, "batch_input.jsonl")
+OUTPUT_CSV = os.path.join(RESULTS_DIR, "batch_analysis_results.csv")
+OUTPUT_HTML = os.path.join(RESULTS_DIR, "batch_visual_report.html")
+
+# How often to ask the server whether the batch is done (seconds)
+POLL_INTERVAL = 60
+
+# Same downscale as the interactive runners: GPT-4o caps vision detail
+# anyway, and inlining full-resolution PNG base64 into 12 records per pair
+# blows straight past the Batch API's input-file cap.
+MAX_IMAGE_EDGE = 1024
+
+# The Batch API rejects input files over 200 MB; checked before upload so
+# an oversize sweep fails fast instead of with a raw API error.
+MAX_BATCH_INPUT_BYTES = 200 * 1024 * 1024
+
+# === 2. Expanded Persona Definitions (12 Types) ===
+PERSONAS = [
+    {"id": "P1_Traditionalist", "desc": "Values heritage, duty, and authority. Skeptical of modern hype.", "bias": "Prefers Authority, Familiarity."},
+    {"id": "P2_Trendsetter", "desc": "Values social status, FOMO, and being first.", "bias": "Prefers Social Proof, Scarcity, Novelty."},
+    {"id": "P3_Safety_Anxious", "desc": "Risk-averse, prioritizes stability and safety.", "bias": "Dislikes Scarcity (stressful). Prefers Trustworthiness, Neutrality."},
+    {"id": "P4_Elite_Luxury", "desc": "Values exclusivity and uniqueness. Dislikes crowds.", "bias": "Prefers Scarcity (if exclusive). Dislikes Social Proof (common)."},
+    {"id": "P5_Skeptic", "desc": "Needs evidence and data. Rejects emotional manipulation.", "bias": "Prefers Trustworthiness (Data). Dislikes Emotional Appeal."},
+    {"id": "P6_Pragmatist", "desc": "Values utility and clear product views.", "bias": "Prefers Neutral/Clear shots. Dislikes artistic fluff."},
+    {"id": "P7_Community", "desc": "Values belonging and family connection.", "bias": "Prefers Social Proof, Emotional Appeal."},
+    {"id": "P8_Individualist", "desc": "Values uniqueness and personal identity.", "bias": "Prefers Personal Identity. Dislikes Social Proof."},
+    {"id": "P9_Futurist", "desc": "Loves innovation and sci-fi aesthetics.", "bias": "Prefers Novelty. Dislikes Familiarity."},
+    {"id": "P10_Naturalist", "desc": "Values purity, nature, and organic cues.", "bias": "Prefers Trustworthiness (Nature). Dislikes Artificiality."},
+    {"id": "P11_Busy_Pro", "desc": "Values efficiency and availability.", "bias": "Prefers Availability. Dislikes lines/wait."},
+    {"id": "P12_Jester", "desc": "Values entertainment and humor.", "bias": "Prefers Humor. Bored by clinical images."}
+]
+
+# Mapping Strategy ID to Name
+PAIR_STRATEGY = {
+    1: "Authority", 2: "Social Proof", 3: "Scarcity", 4: "Emotional Appeal",
+    5: "Personal Identity", 6: "Humor", 7: "Trustworthiness", 8: "Familiarity", 9: "Novelty",
+}
+
+def encode_image(image_path: str) -> str:
+    """Resizes to MAX_IMAGE_EDGE and encodes as a base64 JPEG string.
+
+    Decoded once per image as ascii (base64 output is pure ASCII, so this
+    skips utf-8 validation on multi-MB payloads); the string is then shared
+    by all 12 persona records for the pair.
+    """
+    im = Image.open(image_path)
+    im.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+    buf = io.BytesIO()
+    im.convert("RGB").save(buf, format="JPEG", quality=85)
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+def build_messages(strategy, persona, img_a_b64, img_b_b64):
+    """Same persona-injection prompt as the interactive runners."""
+    system_prompt = (
+        f"You are a participant in a psychology experiment on visual persuasion.\n"
+        f"You are NOT an AI assistant. You are a specific persona:\n"
+        f"ID: {persona['id']}\n"
+        f"Description: {persona['desc']}\n"
+        f"Biases: {persona['bias']}\n\n"
+        f"Adopt this persona completely. Your choices must reflect YOUR specific biases, "
+        f"even if they contradict standard marketing logic. "
+        f"If a strategy (like Scarcity) triggers your anxiety, REJECT IT."
+    )
+    user_prompt = (
+        f"Experiment Context: Testing strategy '{strategy}'.\n"
+        f"You see Image A and Image B.\n\n"
+        f"--- TASK 1: Decision ---\n"
+        f"Which image is MORE persuasive to YOU?\n"
+        f"--- TASK 2: Rationale ---\n"
+        f"Explain WHY. What specific visual details (colors, people, objects) made you choose this? "
+        f"Why did the other image fail for you?\n"
+        f"--- TASK 3: Difficulty Simulation ---\n"
+        f"Imagine a hypothetical 'Image C' (a Weak/Ambiguous version of this strategy).\n"
+        f"Rank the difficulty of comparing: [A vs B], [A vs C], [B vs C] from Easiest to Hardest.\n\n"
+        f"Output VALID JSON:\n"
+        f"{{\n"
+        f"  \"chosen_image\": \"A\" or \"B\",\n"
+        f"  \"rationale\": \"...\",\n"
+        f"  \"difficulty_ranking\": [\"Easiest\", \"Medium\", \"Hardest\"],\n"
+        f"  \"difficulty_reason\": \"...\"\n"
+        f"}}"
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": user_prompt},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_a_b64}"}},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b_b64}"}},
+            ],
+        },
+    ]
+
+def build_batch_jsonl(pairs):
+    """
+    Writes one /v1/chat/completions request per (pair, persona) to the
+    batch input file. custom_id carries "<pair>|<persona>" so answers can
+    be matched back after the batch completes.
+    """
+    n = 0
+    with open(BATCH_INPUT_JSONL, "wb") as f:
+        for idx in sorted(pairs.keys()):
+            if "A" not in pairs[idx] or "B" not in pairs[idx]: continue
+            strategy = PAIR_STRATEGY.get(idx, "Unknown")
+            img_a_b64 = encode_image(pairs[idx]["A"])
+            img_b_b64 = encode_image(pairs[idx]["B"])
+            for persona in PERSONAS:
+                record = {
+                    "custom_id": f"{idx}|{persona['id']}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": MODEL_NAME,
+                        "messages": build_messages(strategy, persona, img_a_b64, img_b_b64),
+                        "temperature": 0.7,
+                        "response_format": {"type": "json_object"},
+                    },
+                }
+                f.write(_dumps_line(record) + b"\n")
+                n += 1
+    return n
+
+def generate_html_report(results, pairs):
+    """Same side-by-side visual report as the interactive runners."""
+    parts = ["""
+    <html>
+    <head>
+        <title>Visual Persuasion Analysis Report (Batch)</title>
+        <style>
+            body { font-family: sans-serif; padding: 20px; background: #f4f4f4; }
+            .pair-container { background: white; padding: 20px; margin-bottom: 30px; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); }
+            .images { display: flex; gap: 20px; margin-bottom: 20px; }
+            .img-box { flex: 1; text-align: center; }
+            .img-box img { max-width: 100%; max-height: 300px; border: 1px solid #ddd; }
+            .results-table { width: 100%; border-collapse: collapse; }
+            .results-table th, .results-table td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+            .results-table th { background-color: #eee; }
+            .choice-A { color: green; font-weight: bold; }
+            .choice-B { color: blue; font-weight: bold; }
+        </style>
+    </head>
+    <body>
+    <h1>Persuasion Analysis: Visual Report (Batch)</h1>
+    """]
+
+    # Same completeness guard as build_batch_jsonl: an orphan file (an A
+    # with no B) was skipped at submission, so it must not KeyError here
+    # after the batch has already completed.
+    for pair_id in sorted(k for k, v in pairs.items() if "A" in v and "B" in v):
+        strategy = PAIR_STRATEGY.get(pair_id, "Unknown")
+        img_a_src = f"../{pairs[pair_id]['A']}"
+        img_b_src = f"../{pairs[pair_id]['B']}"
+
+        parts.append(f"""
+        <div class="pair-container">
+            <h2>Pair {pair_id}: {strategy}</h2>
+            <div class="images">
+                <div class="img-box">
+                    <h3>Image A (Treatment)</h3>
+                    <img src="{img_a_src}" alt="Image A">
+                </div>
+                <div class="img-box">
+                    <h3>Image B (Control)</h3>
+                    <img src="{img_b_src}" alt="Image B">
+                </div>
+            </div>
+            <table class="results-table">
+                <tr>
+                    <th>Persona</th>
+                    <th>Choice</th>
+                    <th>Rationale (The "Why")</th>
+                    <th>Difficulty Rank (Mental Sim)</th>
+                </tr>
+        """)
+
+        for res in [r for r in results if r["Pair_ID"] == pair_id]:
+            choice_class = "choice-A" if res["Choice"] == "A" else "choice-B"
+            parts.append(f"""
+            <tr>
+                <td><strong>{res['Persona_ID']}</strong></td>
+                <td class="{choice_class}">{res['Choice']}</td>
+                <td>{res['Rationale']}</td>
+                <td>{res['Difficulty_Ranking']}</td>
+            </tr>
+            """)
+
+        parts.append("</table></div>")
+
+    parts.append("</body></html>")
+
+    with open(OUTPUT_HTML, "w", encoding="utf-8") as f:
+        f.write("".join(parts))
+    print(f"\n✨ Visual Report generated: {OUTPUT_HTML}")
+
+def main():
+    global client
+    print("=== Visual Persuasion Experiment (Batch API: 50% cost, 24h window) ===")
+
+    # 0. Runtime setup (deferred from import time)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    client = _build_client()
+
+    # 1. Discover Pairs
+    pattern = re.compile(r".*pair\s*(\d+).*([abAB])\.(png|jpg|jpeg)$", re.IGNORECASE)
+    pairs = {}
+
+    if not os.path.exists(IMAGE_DIR):
+        print(f"❌ Error: {IMAGE_DIR} not found.")
+        return
+
+    for fname in os.listdir(IMAGE_DIR):
+        m = pattern.match(fname)
+        if m:
+            idx, side = int(m.group(1)), m.group(2).upper()
+            if idx not in pairs: pairs[idx] = {}
+            pairs[idx][side] = os.path.join(IMAGE_DIR, fname)
+
+    print(f"Found {len(pairs)} image pairs.")
+
+    # 2. Build and upload the batch input
+    n = build_batch_jsonl(pairs)
+    size = os.path.getsize(BATCH_INPUT_JSONL)
+    print(f"📦 Wrote {n} requests to {BATCH_INPUT_JSONL} ({size / (1 << 20):.1f} MB)")
+    if size > MAX_BATCH_INPUT_BYTES:
+        print(f"❌ Error: batch input is {size / (1 << 20):.0f} MB, over the Batch API's "
+              f"{MAX_BATCH_INPUT_BYTES / (1 << 20):.0f} MB cap. Split the sweep into "
+              f"smaller batches or lower MAX_IMAGE_EDGE / the JPEG quality.")
+        return
+
+    with open(BATCH_INPUT_JSONL, "rb") as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"🚀 Batch submitted: {batch.id}")
+
+    # 3. Poll until done (offline job: the 24h SLA is the worst case,
+    # small batches usually clear in minutes)
+    while True:
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        print(f"   ⏳ Status: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed)")
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            break
+        time.sleep(POLL_INTERVAL)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"❌ Batch ended with status '{batch.status}'.")
+        return
+
+    # 4. Parse answers back by custom_id and write the CSV.
+    # iter_lines streams the download: rows hit the disk while the rest of
+    # the file is still in flight, and memory stays flat instead of holding
+    # the whole output (plus every parsed row) at once.
+    all_results = []
+    output = client.files.content(batch.output_file_id)
+
+    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Pair_ID", "Strategy", "Persona_ID", "Choice", "Rationale", "Difficulty_Ranking", "Difficulty_Reasoning"])
+
+        for line in output.iter_lines():
+            if not line.strip(): continue
+            rec = json.loads(line)
+            idx_str, persona_id = rec["custom_id"].split("|", 1)
+            idx = int(idx_str)
+
+            response = rec.get("response")
+            if not response or response.get("status_code") != 200:
+                print(f"   ⚠️ {rec['custom_id']}: request failed in batch.")
+                continue
+
+            try:
+                data = json.loads(response["body"]["choices"][0]["message"]["content"])
+            except (KeyError, IndexError, ValueError) as e:
+                print(f"   ⚠️ {rec['custom_id']}: could not parse answer ({e}).")
+                continue
+
+            row = {
+                "Pair_ID": idx,
+                "Strategy": PAIR_STRATEGY.get(idx, "Unknown"),
+                "Persona_ID": persona_id,
+                "Choice": data.get("chosen_image"),
+                "Rationale": data.get("rationale"),
+                "Difficulty_Ranking": str(data.get("difficulty_ranking")),
+                "Difficulty_Reasoning": data.get("difficulty_reason")
+            }
+            all_results.append(row)
+            writer.writerow(row.values())
+
+    all_results.sort(key=lambda r: (r["Pair_ID"], r["Persona_ID"]))
+
+    # 5. Generate HTML Report
+    generate_html_report(all_results, pairs)
+    print("\n✅ Batch Experiment Complete.")
+    print(f"📄 CSV Data: {OUTPUT_CSV}")
+    print(f"📊 HTML Visual Report: {OUTPUT_HTML}")
+
+if __name__ == "__main__":
+    main()